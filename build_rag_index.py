@@ -8,7 +8,7 @@ build_index.py
                           --model   sentence-transformers/all-MiniLM-L6-v2
 """
 import argparse, json, os, numpy as np, pandas as pd, faiss
-from sentence_transformers import SentenceTransformer
+from donor_encoder import add_encoder_args, get_encoder
 
 
 def donor_to_text(row: pd.Series) -> str:
@@ -20,7 +20,16 @@ def donor_to_text(row: pd.Series) -> str:
     )
 
 
-def build_index(csv_path: str, out_dir: str, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+def index_vectors(index) -> np.ndarray:
+    """Return the stored vectors, as a zero-copy view for flat indexes."""
+    if isinstance(index, faiss.IndexFlat):
+        xb = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d)
+        return xb.reshape(index.ntotal, index.d)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(csv_path: str, out_dir: str, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                backend: str = "torch", onnx_dir: str = "models/onnx"):
     os.makedirs(out_dir, exist_ok=True)
     print(f"📥  Loading donors from {csv_path}")
     df = pd.read_csv(csv_path)
@@ -28,8 +37,8 @@ def build_index(csv_path: str, out_dir: str, model_name: str = "sentence-transfo
     print(f"📝  Converting {len(df)} donors to text …")
     texts = df.apply(donor_to_text, axis=1).to_list()
 
-    print(f"🔄  Encoding with model `{model_name}`")
-    model = SentenceTransformer(model_name)
+    print(f"🔄  Encoding with model `{model_name}` ({backend})")
+    model = get_encoder(backend, model_name, onnx_dir)
     vecs = model.encode(texts, batch_size=64, show_progress_bar=True)
 
     # 建立 FAISS Index
@@ -52,5 +61,6 @@ if __name__ == "__main__":
     ap.add_argument("--donor_csv", required=True, help="Path to donors CSV")
     ap.add_argument("--out_dir", default="models", help="Directory to save index files")
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2", help="SentenceTransformer model name")
+    add_encoder_args(ap)
     args = ap.parse_args()
-    build_index(args.donor_csv, args.out_dir, args.model)
+    build_index(args.donor_csv, args.out_dir, args.model, args.backend, args.onnx_dir)
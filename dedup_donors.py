@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Find near-duplicate donors with a blocked self-join over the FAISS index.
+
+用法：
+    python dedup_donors.py --index_dir models \
+                           --donor_csv output/donors_fake.csv \
+                           --threshold 0.95 --block_by state,age
+"""
+
+import argparse
+import os
+
+import faiss
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from build_rag_index import index_vectors
+
+
+# ---------------------------------------------------------------------------
+# Helper functions
+# ---------------------------------------------------------------------------
+
+JOIN_MAX_HITS = 1 << 24  # cap on search hits / pending edges held at once (~200 MB)
+
+
+def merge_components(labels: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Relabel rows so that every edge (a, b) joins one component.
+
+    ``labels`` maps each row to its current component; a single sparse
+    connected-components pass over the component graph merges all edges.
+    """
+    n = len(labels)
+    graph = coo_matrix((np.ones(len(a), dtype=bool), (labels[a], labels[b])), shape=(n, n))
+    _, comp = connected_components(graph, directed=False)
+    return comp[labels]
+
+
+def update_best(best_sim: np.ndarray, best_match: np.ndarray, a: np.ndarray, b: np.ndarray, sims: np.ndarray):
+    """Record each row's most similar partner among the edges (a, b)."""
+    nodes, partner, sims = np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([sims, sims])
+    order = np.lexsort((-sims, nodes))
+    nodes, partner, sims = nodes[order], partner[order], sims[order]
+    first = np.flatnonzero(np.r_[True, nodes[1:] != nodes[:-1]])
+    nodes, partner, sims = nodes[first], partner[first], sims[first]
+    better = sims > best_sim[nodes]
+    best_sim[nodes[better]] = sims[better]
+    best_match[nodes[better]] = partner[better]
+
+
+def block_keys(df: pd.DataFrame, donor_ids: np.ndarray, block_by: list, age_bucket: int) -> np.ndarray:
+    """Return one block label per index row; rows only match inside their block."""
+    rows = df.iloc[donor_ids]
+    parts = []
+    for col in block_by:
+        if col == "age":
+            parts.append((rows["age"].fillna(-1) // age_bucket).astype(int).astype(str))
+        else:
+            parts.append(rows[col].fillna("").astype(str).str.strip().str.lower())
+    keys = parts[0].str.cat(parts[1:], sep="|") if len(parts) > 1 else parts[0]
+    return pd.factorize(keys.to_numpy())[0]
+
+
+def tile_pairs(tile: np.ndarray, index, threshold: float, k: int):
+    """Return (query_offset, neighbour_pos, sim) for one tile of query vectors."""
+    if k:
+        D, I = index.search(tile, k + 1)
+        q, pos = np.nonzero((D >= threshold) & (I >= 0))
+        return q, I[q, pos], D[q, pos]
+    lims, D, I = index.range_search(tile, threshold)
+    q = np.repeat(np.arange(len(tile)), np.diff(lims).astype(np.int64))
+    return q, I, D
+
+
+def self_join(index, rows: np.ndarray, threshold: float, k: int, tile_size: int,
+              labels: np.ndarray, best_sim: np.ndarray, best_match: np.ndarray):
+    """Join the vectors of ``index`` (global rows ``rows``) against themselves.
+
+    Range search may return every row of the block for each query, so a tile
+    is cut to ``JOIN_MAX_HITS // len(rows)`` queries; k-NN returns at most
+    ``k + 1`` hits per query. Edges are merged into ``labels`` whenever
+    ``JOIN_MAX_HITS`` of them are pending, so peak memory stays bounded by the
+    hit budget plus O(N), whatever the threshold. Low thresholds on templated
+    donor texts still cost time proportional to the hit count; use ``--k``.
+
+    Returns (updated labels, number of edges).
+    """
+    step = tile_size if k else max(1, min(tile_size, JOIN_MAX_HITS // len(rows)))
+    vecs = index_vectors(index)
+    n_edges, pending, n_pending = 0, [], 0
+    for start in range(0, len(rows), step):
+        q, nb, sims = tile_pairs(vecs[start:start + step], index, threshold, k)
+        src = q + start
+        # k-NN lists are not symmetric, so keep both directions and only drop
+        # self matches; a pair seen twice is harmless for the component merge.
+        keep = src != nb
+        src, nb, sims = src[keep], nb[keep], sims[keep]
+        a, b = rows[np.minimum(src, nb)], rows[np.maximum(src, nb)]
+        if len(a):
+            update_best(best_sim, best_match, a, b, sims)
+            pending.append((a, b))
+            n_pending += len(a)
+            n_edges += len(a)
+        if n_pending >= JOIN_MAX_HITS:
+            labels = merge_components(labels, *map(np.concatenate, zip(*pending)))
+            pending, n_pending = [], 0
+    if pending:
+        labels = merge_components(labels, *map(np.concatenate, zip(*pending)))
+    return labels, n_edges
+
+
+def find_duplicates(index, donor_ids: np.ndarray, blocks: np.ndarray, threshold: float,
+                    k: int, tile_size: int) -> pd.DataFrame:
+    """Return one row per donor that belongs to a duplicate cluster."""
+    n = index.ntotal
+    labels = np.arange(n, dtype=np.int64)
+    best_sim = np.full(n, -np.inf, dtype="float32")
+    best_match = np.full(n, -1, dtype=np.int64)
+
+    order = np.argsort(blocks, kind="stable")
+    bounds = np.flatnonzero(np.diff(blocks[order])) + 1
+    n_edges = 0
+    if len(bounds) == 0:
+        # One block: search the loaded index in place instead of copying it
+        labels, n_edges = self_join(index, np.arange(n), threshold, k, tile_size, labels, best_sim, best_match)
+    else:
+        vecs = index_vectors(index)
+        for rows in np.split(order, bounds):
+            if len(rows) < 2:
+                continue
+            block_index = faiss.IndexFlatIP(index.d)
+            block_index.add(np.ascontiguousarray(vecs[rows], dtype="float32"))
+            labels, edges = self_join(block_index, rows, threshold, k, tile_size, labels, best_sim, best_match)
+            n_edges += edges
+            del block_index
+    print(f"🔗  {n_edges} candidate edges ≥ {threshold} across {len(bounds) + 1} blocks")
+
+    dup_rows = np.flatnonzero(best_match >= 0)
+    out = pd.DataFrame({
+        "root": labels[dup_rows],
+        "donor_id": donor_ids[dup_rows],
+        "matched_donor_id": donor_ids[best_match[dup_rows]],
+        "similarity": best_sim[dup_rows].round(4),
+    })
+    out["cluster_size"] = out.groupby("root")["root"].transform("size")
+    out["cluster_id"] = pd.factorize(out["root"])[0]
+    out = out.sort_values(["cluster_size", "cluster_id", "similarity"], ascending=[False, True, False])
+    return out[["cluster_id", "cluster_size", "donor_id", "matched_donor_id", "similarity"]]
+
+
+# ---------------------------------------------------------------------------
+# Main CLI
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Cluster near-duplicate donors from the FAISS index")
+    ap.add_argument("--index_dir", required=True, help="Folder with donor_vectors.faiss & donor_ids.npy")
+    ap.add_argument("--donor_csv", default=None, help="CSV for blocking columns and name lookup")
+    ap.add_argument("--threshold", type=float, default=0.95, help="Minimum cosine similarity for a duplicate pair")
+    ap.add_argument("--k", type=int, default=0,
+                    help="Use k-NN per donor instead of range search (0 = range search)")
+    ap.add_argument("--block_by", default="",
+                    help="Comma-separated columns to pre-block on, e.g. 'state,age' (needs --donor_csv)")
+    ap.add_argument("--age_bucket", type=int, default=10, help="Width in years of an age block")
+    ap.add_argument("--tile_size", type=int, default=4096, help="Query vectors searched per tile")
+    ap.add_argument("--threads", type=int, default=0, help="FAISS worker threads (0 = all cores)")
+    ap.add_argument("--out_csv", default="output/donor_duplicates.csv", help="Where to save duplicate clusters")
+    args = ap.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    index = faiss.read_index(f"{args.index_dir}/donor_vectors.faiss")
+    donor_ids = np.load(f"{args.index_dir}/donor_ids.npy")
+    df = pd.read_csv(args.donor_csv) if args.donor_csv else None
+
+    block_by = [c.strip() for c in args.block_by.split(",") if c.strip()]
+    if block_by:
+        if df is None:
+            ap.error("--block_by requires --donor_csv")
+        blocks = block_keys(df, donor_ids, block_by, args.age_bucket)
+    else:
+        blocks = np.zeros(index.ntotal, dtype=np.int64)
+
+    print(f"🔍  Self-joining {index.ntotal} donors (threshold {args.threshold})")
+    dups = find_duplicates(index, donor_ids, blocks, args.threshold, args.k, args.tile_size)
+
+    if df is not None:
+        name_col = "full_name" if "full_name" in df.columns else df.columns[0]
+        names = df[name_col].to_numpy()
+        dups.insert(3, "name", names[dups["donor_id"]])
+        dups.insert(5, "matched_name", names[dups["matched_donor_id"]])
+
+    os.makedirs(os.path.dirname(args.out_csv) or ".", exist_ok=True)
+    dups.to_csv(args.out_csv, index=False)
+    print(f"✅  {dups['cluster_id'].nunique()} duplicate clusters ({len(dups)} donors) → {args.out_csv}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+donor_encoder.py
+----------------
+Pluggable sentence encoders for the donor / event embedding scripts.
+
+Backends:
+    torch      SentenceTransformer in fp32 (the original path)
+    onnx       exported MiniLM run with onnxruntime in fp32
+    onnx-int8  same graph with dynamically quantized int8 weights
+
+All backends use the model's own tokenizer and mean pooling and return
+L2-normalized float32 vectors, so they can query an index built by any other.
+
+用法：
+    # Export fp32 + int8 ONNX graphs
+    python donor_encoder.py export --out_dir models/onnx
+
+    # Compare against the PyTorch path (cosine drift, top-k overlap, throughput)
+    python donor_encoder.py check --onnx_dir models/onnx \
+                                  --donor_csv output/donors_fake.csv
+"""
+import argparse, json, os, time, numpy as np
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model-int8.onnx"}
+META_FILE = "encoder.json"  # model name + dimension recorded at export
+MAX_SEQ_LEN = 256  # all-MiniLM-L6-v2 max_seq_length
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+class TorchEncoder:
+    """SentenceTransformer wrapper returning normalized float32 vectors."""
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size: int = 64, show_progress_bar: bool = False) -> np.ndarray:
+        vecs = self.model.encode(list(texts), batch_size=batch_size, show_progress_bar=show_progress_bar)
+        return _normalize(vecs)
+
+
+class OnnxEncoder:
+    """onnxruntime encoder with the same tokenization and mean pooling as MiniLM."""
+
+    def __init__(self, onnx_path: str, tokenizer_dir: str, dim: int, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self.dim = dim
+
+    def encode(self, texts, batch_size: int = 64, show_progress_bar: bool = False) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype="float32")
+        # Batch texts of similar length together to keep padding small
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        chunks = []
+        starts = range(0, len(texts), batch_size)
+        if show_progress_bar:
+            from tqdm import tqdm
+            starts = tqdm(starts, desc="Batches")
+        for start in starts:
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer([texts[i] for i in idx], padding=True, truncation=True,
+                                 max_length=MAX_SEQ_LEN, return_tensors="np")
+            feed = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            mask = enc["attention_mask"][..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            chunks.append(pooled)
+        vecs = np.empty((len(texts), self.dim), dtype="float32")
+        vecs[order] = np.concatenate(chunks)
+        return _normalize(vecs)
+
+
+def get_encoder(backend: str = "torch", model_name: str = MODEL_NAME, onnx_dir: str = "models/onnx",
+                threads: int = 0):
+    """Return an encoder exposing ``encode(texts, batch_size, show_progress_bar)``."""
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend in ONNX_FILES:
+        path = os.path.join(onnx_dir, ONNX_FILES[backend])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run `python donor_encoder.py export --out_dir {onnx_dir}`")
+        with open(os.path.join(onnx_dir, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["model_name"] != model_name:
+            raise ValueError(f"{onnx_dir} was exported from {meta['model_name']!r}, not {model_name!r}; "
+                             f"re-run `python donor_encoder.py export --model {model_name} --out_dir <dir>`")
+        return OnnxEncoder(path, onnx_dir, meta["dim"], threads)
+    raise ValueError(f"Unknown encoder backend {backend!r}; choose from {BACKENDS}")
+
+
+def add_encoder_args(ap: argparse.ArgumentParser):
+    """Add the shared --backend / --onnx_dir options to a script's parser."""
+    ap.add_argument("--backend", choices=BACKENDS, default="torch", help="Embedding backend")
+    ap.add_argument("--onnx_dir", default="models/onnx", help="Folder with exported ONNX model + tokenizer")
+
+
+# ---------------------------------------------------------------------------
+# Export and parity check
+# ---------------------------------------------------------------------------
+
+def export_onnx(model_name: str, out_dir: str, opset: int = 14):
+    """Export the transformer to ONNX (fp32) and a dynamic int8 copy."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)
+
+    dummy = tokenizer(["export sample"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+
+    fp32_path = os.path.join(out_dir, ONNX_FILES["onnx"])
+    int8_path = os.path.join(out_dir, ONNX_FILES["onnx-int8"])
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(dummy[n] for n in names), fp32_path, input_names=names,
+                          output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=opset)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "dim": model.config.hidden_size}, f, indent=2)
+
+    print(f"✅  Saved fp32 ONNX →  {fp32_path}")
+    print(f"✅  Saved int8 ONNX →  {int8_path}")
+
+
+def _timed_encode(encoder, texts, batch_size: int):
+    t0 = time.perf_counter()
+    vecs = encoder.encode(texts, batch_size=batch_size)
+    return vecs, len(texts) / (time.perf_counter() - t0)
+
+
+def parity_check(texts, onnx_dir: str, model_name: str, top_k: int, n_queries: int, batch_size: int,
+                 threads: int = 0):
+    """Print cosine drift, top-k overlap and throughput of each backend vs torch."""
+    ref, ref_tps = _timed_encode(TorchEncoder(model_name), texts, batch_size)
+    queries = ref[:n_queries]
+    ref_top = np.argsort(-(queries @ ref.T), axis=1)[:, :top_k]
+
+    print(f"{'backend':<10} {'texts/s':>9} {'speedup':>8} {'cos mean':>9} {'cos min':>8} {'top-k overlap':>14}")
+    print(f"{'torch':<10} {ref_tps:>9.1f} {1.0:>8.2f} {1.0:>9.4f} {1.0:>8.4f} {1.0:>14.3f}")
+    for backend in ONNX_FILES:
+        vecs, tps = _timed_encode(get_encoder(backend, model_name, onnx_dir, threads), texts, batch_size)
+        cos = (vecs * ref).sum(axis=1)
+        top = np.argsort(-(vecs[:n_queries] @ vecs.T), axis=1)[:, :top_k]
+        overlap = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(ref_top, top)])
+        print(f"{backend:<10} {tps:>9.1f} {tps / ref_tps:>8.2f} {cos.mean():>9.4f} {cos.min():>8.4f} {overlap:>14.3f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export and validate ONNX encoder backends")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    exp = sub.add_parser("export", help="Export fp32 and int8 ONNX models")
+    exp.add_argument("--model", default=MODEL_NAME, help="HuggingFace model name")
+    exp.add_argument("--out_dir", default="models/onnx", help="Where to write the ONNX files")
+    exp.add_argument("--opset", type=int, default=14, help="ONNX opset version")
+
+    chk = sub.add_parser("check", help="Parity and throughput vs the PyTorch encoder")
+    chk.add_argument("--model", default=MODEL_NAME, help="HuggingFace model name")
+    chk.add_argument("--onnx_dir", default="models/onnx", help="Folder with exported ONNX files")
+    chk.add_argument("--donor_csv", required=True, help="Donor CSV providing sample texts")
+    chk.add_argument("--n_texts", type=int, default=1000, help="Number of donor texts to encode")
+    chk.add_argument("--n_queries", type=int, default=100, help="Texts used as top-k queries")
+    chk.add_argument("--top_k", type=int, default=10, help="k for top-k overlap")
+    chk.add_argument("--batch_size", type=int, default=64, help="Encoding batch size")
+    chk.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads (0 = default)")
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        export_onnx(args.model, args.out_dir, args.opset)
+    else:
+        import pandas as pd
+        from build_rag_index import donor_to_text
+
+        df = pd.read_csv(args.donor_csv).head(args.n_texts)
+        texts = df.apply(donor_to_text, axis=1).to_list()
+        parity_check(texts, args.onnx_dir, args.model, args.top_k, min(args.n_queries, len(texts)),
+                     args.batch_size, args.threads)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 import argparse, numpy as np, faiss, pandas as pd
-from sentence_transformers import SentenceTransformer
+from donor_encoder import add_encoder_args, get_encoder
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
@@ -10,6 +10,7 @@ if __name__ == '__main__':
     ap.add_argument('--donor_csv', required=False, default='donors_1k.csv', help='CSV for lookup')
     ap.add_argument('--query', required=True, help='Text query for event or criteria')
     ap.add_argument('--top_k', type=int, default=5, help='Number of donors to retrieve')
+    add_encoder_args(ap)
     args = ap.parse_args()
 
     # Load index and ids
@@ -17,7 +18,7 @@ if __name__ == '__main__':
     donor_ids = np.load(f"{args.index_dir}/donor_ids.npy")
 
     # Encode query
-    model = SentenceTransformer(MODEL_NAME)
+    model = get_encoder(args.backend, MODEL_NAME, args.onnx_dir)
     q_vec = model.encode([args.query])
     faiss.normalize_L2(q_vec)
 
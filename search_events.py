@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
-import argparse, json, numpy as np, faiss, pandas as pd
-from sentence_transformers import SentenceTransformer
+"""Rank events by aggregate donor similarity, streaming the events file.
+
+Events are read in chunks from CSV, a JSON array or JSONL, embedded and scored
+chunk by chunk, and only a bounded top-k heap is kept, so memory stays flat no
+matter how large the catalog is. ``--follow`` keeps tailing an appended JSONL
+feed and re-prints the current top-k as new events arrive.
+"""
+import argparse, heapq, json, time, numpy as np, faiss, pandas as pd
+from donor_encoder import add_encoder_args, get_encoder
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
@@ -12,48 +19,165 @@ def event_to_text(e):
         f"Date: {e.get('Event_Date', e.get('date_start',''))}"
     )
 
+# ---------------------------------------------------------------------------
+# Incremental readers – each yields lists of at most `chunk_size` event dicts
+# ---------------------------------------------------------------------------
+
+def iter_csv(path, chunk_size):
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        yield chunk.to_dict(orient='records')
+
+def iter_json_array(path, chunk_size, block_size=1 << 16):
+    """Decode a top-level JSON array one element at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf, pos, eof, started, batch = '', 0, False, False, []
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if not started and pos < len(buf):
+                if buf[pos] != '[':
+                    raise ValueError(f"{path} is not a JSON array")
+                started, pos = True, pos + 1
+                continue
+            if pos < len(buf) and buf[pos] == ']':
+                break
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    if buf[pos:].strip():
+                        raise
+                    break
+                block = f.read(block_size)
+                eof = not block
+                buf, pos = buf[pos:] + block, 0
+                continue
+            # An element ending exactly at the buffer edge may be a truncated number
+            if end == len(buf) and not eof:
+                block = f.read(block_size)
+                eof = not block
+                buf, pos = buf[pos:] + block, 0
+                continue
+            batch.append(obj)
+            pos = end
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def iter_jsonl(path, chunk_size, follow=False, poll_interval=1.0):
+    """Yield JSONL records; with `follow`, keep waiting for appended lines."""
+    with open(path, 'r', encoding='utf-8') as f:
+        batch = []
+        while True:
+            where = f.tell()
+            line = f.readline()
+            if line.endswith('\n') or (line and not follow):
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= chunk_size:
+                    yield batch
+                    batch = []
+                continue
+            # EOF (or a partially written line while following)
+            f.seek(where)
+            if batch:
+                yield batch
+                batch = []
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+def iter_events(path, chunk_size, follow=False, poll_interval=1.0):
+    if path.endswith('.csv'):
+        return iter_csv(path, chunk_size)
+    if path.endswith('.jsonl'):
+        return iter_jsonl(path, chunk_size, follow, poll_interval)
+    return iter_json_array(path, chunk_size)
+
+# ---------------------------------------------------------------------------
+# Scoring
+# ---------------------------------------------------------------------------
+
+def donor_sum_vector(index):
+    """Sum of all donor vectors; mean/sum cosine of an event is one dot product with it."""
+    total = np.zeros(index.d, dtype='float64')
+    for start in range(0, index.ntotal, 65536):
+        total += index.reconstruct_n(start, min(65536, index.ntotal - start)).sum(axis=0)
+    return total.astype('float32')
+
+COUNT_MAX_HITS = 1 << 24  # cap on range_search hits held at once (~200 MB)
+
+def score_chunk(vecs, index, metric, donor_sum):
+    if metric == 'mean':
+        return vecs @ donor_sum / index.ntotal
+    if metric == 'sum':
+        return vecs @ donor_sum
+    # count of sims > 0.5; every donor may be a hit, so search few enough
+    # events per call that the result stays bounded however large the chunk
+    step = max(1, COUNT_MAX_HITS // max(1, index.ntotal))
+    counts = np.empty(len(vecs), dtype='int64')
+    for start in range(0, len(vecs), step):
+        lims, _, _ = index.range_search(vecs[start:start + step], 0.5)
+        counts[start:start + step] = np.diff(lims)
+    return counts
+
+def push_top_k(heap, top_k, score, seq, event):
+    """Keep the `top_k` best events; earlier events win ties, as with a stable sort."""
+    if top_k <= 0:
+        return
+    item = (score, -seq, event)
+    if len(heap) < top_k:
+        heapq.heappush(heap, item)
+    elif item[:2] > heap[0][:2]:
+        heapq.heapreplace(heap, item)
+
+def print_top(heap, top_k, metric, n_seen):
+    print(f"Top {top_k} events by donor similarity ({metric}) after {n_seen} events:")
+    for score, _, ev in sorted(heap, key=lambda x: x[:2], reverse=True):
+        name = ev.get('Event_Name', ev.get('title',''))
+        print(f"- {name} (Score: {score})")
+
 if __name__ == '__main__':
     ap = argparse.ArgumentParser(description='Rank events by aggregate donor similarity')
     ap.add_argument('--index_dir', required=True, help='Folder with donor_vectors.faiss & donor_ids.npy')
-    ap.add_argument('--events_file', required=True, help='CSV or JSON file with events list')
+    ap.add_argument('--events_file', required=True, help='CSV, JSON array or JSONL file with events')
     ap.add_argument('--top_k', type=int, default=5, help='Number of top events to return')
     ap.add_argument('--metric', choices=['mean','sum','count'], default='mean',
                    help="Aggregation metric: mean cosine, sum cosine, or count>0.5 similarity")
+    ap.add_argument('--chunk_size', type=int, default=1024, help='Events read and embedded per chunk')
+    ap.add_argument('--report_every', type=int, default=0,
+                    help='Print the running top-k every N chunks (0 = only at the end)')
+    ap.add_argument('--follow', action='store_true',
+                    help='Keep tailing an appended JSONL file and print the top-k after new events')
+    ap.add_argument('--poll_interval', type=float, default=1.0, help='Seconds between checks in --follow mode')
+    add_encoder_args(ap)
     args = ap.parse_args()
+    if args.follow and not args.events_file.endswith('.jsonl'):
+        ap.error('--follow only works with an appended .jsonl events file')
 
     # Load donors index
     index = faiss.read_index(f"{args.index_dir}/donor_vectors.faiss")
-    donor_ids = np.load(f"{args.index_dir}/donor_ids.npy")
-    n_donors = len(donor_ids)
-
-    # Load events
-    if args.events_file.endswith('.csv'):
-        events = pd.read_csv(args.events_file).to_dict(orient='records')
-    else:
-        events = json.load(open(args.events_file, 'r', encoding='utf-8'))
-
-    # Embed events
-    model = SentenceTransformer(MODEL_NAME)
-    texts = [event_to_text(e) for e in events]
-    vecs = model.encode(texts, batch_size=32, show_progress_bar=False)
-    faiss.normalize_L2(vecs)
-
-    # Score each event
-    results = []
-    for e, vec in zip(events, vecs):
-        D, I = index.search(vec.reshape(1, -1), n_donors)
-        sims = D[0]
-        if args.metric == 'mean':
-            score = float(sims.mean())
-        elif args.metric == 'sum':
-            score = float(sims.sum())
-        else:  # count of sims > 0.5
-            score = int((sims > 0.5).sum())
-        results.append({**e, 'score': round(score,4)})
-
-    # Sort and output
-    results = sorted(results, key=lambda x: x['score'], reverse=True)[:args.top_k]
-    print(f"Top {args.top_k} events by donor similarity ({args.metric}):")
-    for ev in results:
-        name = ev.get('Event_Name', ev.get('title',''))
-        print(f"- {name} (Score: {ev['score']})")
+    donor_sum = donor_sum_vector(index) if args.metric != 'count' else None
+
+    model = get_encoder(args.backend, MODEL_NAME, args.onnx_dir)
+
+    heap, n_seen = [], 0
+    try:
+        chunks = iter_events(args.events_file, args.chunk_size, args.follow, args.poll_interval)
+        for n_chunks, events in enumerate(chunks, 1):
+            vecs = model.encode([event_to_text(e) for e in events], batch_size=32, show_progress_bar=False)
+            faiss.normalize_L2(vecs)
+            for e, score in zip(events, score_chunk(vecs, index, args.metric, donor_sum)):
+                score = round(float(score), 4) if args.metric != 'count' else int(score)
+                push_top_k(heap, args.top_k, score, n_seen, {**e, 'score': score})
+                n_seen += 1
+            if args.follow or (args.report_every and n_chunks % args.report_every == 0):
+                print_top(heap, args.top_k, args.metric, n_seen)
+    except KeyboardInterrupt:
+        pass
+
+    if not args.follow:
+        print_top(heap, args.top_k, args.metric, n_seen)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Segment donors with k-means over the stored embedding index.
+
+用法：
+    # 1. Cluster the index once and save segment files next to it
+    python segment_donors.py fit --index_dir models \
+                                 --donor_csv output/donors_fake.csv --k 32
+
+    # 2. Which segments fit this event? (K dot products instead of N)
+    python segment_donors.py lookup --index_dir models --query "children's education gala"
+
+    # 3. List the donors of one segment (an array slice, no search)
+    python segment_donors.py lookup --index_dir models --segment 7 \
+                                    --donor_csv output/donors_fake.csv
+"""
+
+import argparse
+import json
+import os
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from build_rag_index import index_vectors
+from donor_encoder import add_encoder_args, get_encoder
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+CENTROIDS_FILE = "segment_centroids.npy"
+ASSIGN_FILE = "donor_segments.npy"
+ORDER_FILE = "segment_order.npy"
+OFFSETS_FILE = "segment_offsets.npy"
+PROFILE_FILE = "segment_profiles.csv"
+META_FILE = "segment_meta.json"  # index size + k the segments were fitted on
+
+
+# ---------------------------------------------------------------------------
+# Helper functions
+# ---------------------------------------------------------------------------
+
+def fit_segments(vecs: np.ndarray, k: int, niter: int, sample_per_centroid: int, seed: int):
+    """Train spherical k-means and return (centroids, per-row assignments).
+
+    Training is capped at ``sample_per_centroid`` × k random points (FAISS
+    subsamples internally), so large N costs a mini-batch fit plus one
+    assignment pass.
+    """
+    km = faiss.Kmeans(vecs.shape[1], k, niter=niter, spherical=True, seed=seed,
+                      max_points_per_centroid=sample_per_centroid, verbose=False)
+    km.train(vecs)
+    assign = np.empty(len(vecs), dtype=np.int32)
+    for start in range(0, len(vecs), 65536):
+        _, I = km.index.search(vecs[start:start + 65536], 1)
+        assign[start:start + 65536] = I[:, 0]
+    return km.centroids, assign
+
+
+def segment_profiles(assign: np.ndarray, k: int, donor_ids: np.ndarray, df, top_n: int) -> pd.DataFrame:
+    """Return per-segment size, mean lifetime giving and most common causes."""
+    prof = pd.DataFrame({"segment": np.arange(k), "size": np.bincount(assign, minlength=k)})
+    if df is None:
+        return prof
+    rows = df.iloc[donor_ids].assign(segment=assign)
+    grouped = rows.groupby("segment")
+    prof["mean_lifetime_donation_usd"] = grouped["lifetime_donation_usd"].mean().reindex(prof.segment).round(2).values
+    top = grouped["primary_cause"].agg(lambda s: "; ".join(s.value_counts().head(top_n).index.astype(str)))
+    prof["top_causes"] = top.reindex(prof.segment).fillna("").values
+    return prof
+
+
+def save_segments(out_dir: str, centroids: np.ndarray, assign: np.ndarray, profiles: pd.DataFrame):
+    """Persist centroids, assignments and a segment-sorted row order with offsets."""
+    k = len(centroids)
+    order = np.argsort(assign, kind="stable").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=k))]).astype(np.int64)
+    np.save(os.path.join(out_dir, CENTROIDS_FILE), centroids)
+    np.save(os.path.join(out_dir, ASSIGN_FILE), assign)
+    np.save(os.path.join(out_dir, ORDER_FILE), order)
+    np.save(os.path.join(out_dir, OFFSETS_FILE), offsets)
+    profiles.to_csv(os.path.join(out_dir, PROFILE_FILE), index=False)
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"ntotal": int(len(assign)), "k": int(k)}, f, indent=2)
+
+
+def load_segment_meta(index_dir: str, n_donors: int) -> dict:
+    """Return the saved segment metadata, refusing files from another index build."""
+    with open(os.path.join(index_dir, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["ntotal"] != n_donors:
+        raise SystemExit(f"Segments in {index_dir} were fitted on {meta['ntotal']} donors but the index has "
+                         f"{n_donors}; re-run `python segment_donors.py fit --index_dir {index_dir}`")
+    return meta
+
+
+def segment_rows(index_dir: str, segment: int) -> np.ndarray:
+    """Return index rows in ``segment`` as a slice of the sorted order."""
+    order = np.load(os.path.join(index_dir, ORDER_FILE), mmap_mode="r")
+    offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+    return np.asarray(order[offsets[segment]:offsets[segment + 1]])
+
+
+def match_segments(index_dir: str, query: str, top_k: int, encoder):
+    """Score ``query`` against segment centroids; returns (segments, sims)."""
+    centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+    q_vec = encoder.encode([query])
+    faiss.normalize_L2(q_vec)
+    sims = centroids @ q_vec[0]
+    top = np.argsort(-sims)[:top_k]
+    return top, sims[top]
+
+
+# ---------------------------------------------------------------------------
+# Main CLI
+# ---------------------------------------------------------------------------
+
+def run_fit(args):
+    index = faiss.read_index(f"{args.index_dir}/donor_vectors.faiss")
+    donor_ids = np.load(f"{args.index_dir}/donor_ids.npy")
+    df = pd.read_csv(args.donor_csv) if args.donor_csv else None
+
+    print(f"🧮  Clustering {index.ntotal} donors into {args.k} segments …")
+    centroids, assign = fit_segments(index_vectors(index), args.k, args.niter,
+                                     args.sample_per_centroid, args.seed)
+    profiles = segment_profiles(assign, args.k, donor_ids, df, args.top_causes)
+    save_segments(args.index_dir, centroids, assign, profiles)
+    print(profiles.to_string(index=False))
+    print(f"✅  Saved segments →  {args.index_dir}/{PROFILE_FILE}")
+
+
+def run_lookup(args):
+    donor_ids = np.load(f"{args.index_dir}/donor_ids.npy")
+    meta = load_segment_meta(args.index_dir, len(donor_ids))
+    if args.segment is not None and not 0 <= args.segment < meta["k"]:
+        raise SystemExit(f"--segment must be between 0 and {meta['k'] - 1}")
+    profiles = pd.read_csv(os.path.join(args.index_dir, PROFILE_FILE)).set_index("segment")
+
+    if args.query:
+        encoder = get_encoder(args.backend, MODEL_NAME, args.onnx_dir)
+        segs, sims = match_segments(args.index_dir, args.query, args.top_k, encoder)
+        print(f"Top {len(segs)} segments for query '{args.query}':")
+        for seg, sim in zip(segs, sims):
+            print(f"- Segment {seg} (Score: {sim:.4f}) {profiles.loc[seg].to_dict()}")
+
+    if args.segment is not None:
+        ids = donor_ids[segment_rows(args.index_dir, args.segment)]
+        print(f"Segment {args.segment}: {len(ids)} donors {profiles.loc[args.segment].to_dict()}")
+        df = pd.read_csv(args.donor_csv) if args.donor_csv else None
+        for donor_id in ids[:args.limit]:
+            print(f"- {df.iloc[donor_id].to_dict() if df is not None else f'ID {donor_id}'}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Donor segmentation over the embedding index")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    fit = sub.add_parser("fit", help="Run k-means and save segment files next to the index")
+    fit.add_argument("--index_dir", required=True, help="Folder with donor_vectors.faiss & donor_ids.npy")
+    fit.add_argument("--donor_csv", default=None, help="CSV used for per-segment aggregates")
+    fit.add_argument("--k", type=int, default=32, help="Number of segments")
+    fit.add_argument("--niter", type=int, default=20, help="k-means iterations")
+    fit.add_argument("--sample_per_centroid", type=int, default=256,
+                     help="Training points per centroid (caps the fit sample for large N)")
+    fit.add_argument("--top_causes", type=int, default=3, help="Causes listed per segment")
+    fit.add_argument("--seed", type=int, default=1234, help="Random seed")
+    fit.set_defaults(func=run_fit)
+
+    look = sub.add_parser("lookup", help="Match a query to segments or list a segment's donors")
+    look.add_argument("--index_dir", required=True, help="Folder with the saved segment files")
+    look.add_argument("--query", default=None, help="Event or criteria text to match to segments")
+    look.add_argument("--top_k", type=int, default=5, help="Number of segments to return")
+    look.add_argument("--segment", type=int, default=None, help="Segment id to list donors for")
+    look.add_argument("--donor_csv", default=None, help="CSV for donor lookup")
+    look.add_argument("--limit", type=int, default=20, help="Max donors printed for --segment")
+    add_encoder_args(look)
+    look.set_defaults(func=run_lookup)
+
+    args = ap.parse_args()
+    if args.cmd == "lookup" and args.query is None and args.segment is None:
+        look.error("give --query and/or --segment")
+    args.func(args)
@@ -5,10 +5,15 @@ import argparse
 import csv
 import json
 import random
+import re
 from pathlib import Path
 
 import pandas as pd
-from transformers import pipeline
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList, pipeline
+
+KPI_KEYS = ["rsvp_pct", "conv_rate", "avg_gift_hkd", "retention_pct", "attendees", "revenue"]
+NUMBER_RE = re.compile(r"\d+(\.\d*)?")
 
 # ---------------------------------------------------------------------------
 # Helper functions
@@ -36,8 +41,124 @@ def baseline_estimate(event: dict, donor_count: int, scale: float) -> tuple:
     return est_donors, est_revenue
 
 
-def llm_estimate(event: dict, donor_names: list, baseline: tuple, generator) -> dict:
-    """Query the language model to refine KPI estimates."""
+class KpiJsonConstraint:
+    """Token-level grammar forcing ``{"rsvp_pct": <num>, ..., "revenue": <num>}``.
+
+    Keys and punctuation are forced, values may only use digit and ``.``
+    tokens, and generation stops as soon as the closing brace is emitted.
+    The vocabulary table is built once per tokenizer and reused across calls.
+    """
+
+    def __init__(self, tokenizer, keys=KPI_KEYS, max_digits: int = 9):
+        self.eos_token_id = tokenizer.eos_token_id
+        self.max_digits = max_digits
+        # Literal pieces interleaved with ``None`` placeholders for numbers
+        self.pieces = []
+        for i, key in enumerate(keys):
+            self.pieces += [("{" if i == 0 else ", ") + f'"{key}": ', None]
+        self.pieces.append("}")
+
+        # Decode every token after a fixed prefix so leading spaces survive
+        base = tokenizer.encode("a", add_special_tokens=False)
+        base_len = len(tokenizer.decode(base))
+        vocab = tokenizer.batch_decode([base + [i] for i in range(len(tokenizer))])
+        self.token_text = [t[base_len:] for t in vocab]
+        self.ids_by_text = {}
+        for i, text in enumerate(self.token_text):
+            if text:
+                self.ids_by_text.setdefault(text, []).append(i)
+        # Digit tokens by length; multi-digit tokens with a leading zero are kept
+        # apart because JSON numbers cannot start with "0" followed by a digit
+        self.digit_ids, self.zero_lead_ids = {}, {}
+        for text, ids in self.ids_by_text.items():
+            if text.isdigit() and text.isascii():
+                table = self.zero_lead_ids if len(text) > 1 and text[0] == "0" else self.digit_ids
+                table.setdefault(len(text), []).extend(ids)
+        self.dot_ids = self.ids_by_text.get(".", [])
+
+    def parse(self, text: str) -> tuple:
+        """Return (piece index, partial text of that piece) for generated ``text``."""
+        pos = 0
+        for i, piece in enumerate(self.pieces):
+            if piece is None:
+                m = NUMBER_RE.match(text, pos)
+                num = m.group(0) if m else ""
+                pos += len(num)
+                if pos == len(text):
+                    return i, num
+            elif text.startswith(piece, pos):
+                pos += len(piece)
+            else:
+                return i, text[pos:]
+        return len(self.pieces), ""
+
+    def _prefix_ids(self, literal: str) -> list:
+        ids = []
+        for end in range(1, len(literal) + 1):
+            ids += self.ids_by_text.get(literal[:end], [])
+        return ids
+
+    def allowed_ids(self, text: str) -> list:
+        i, partial = self.parse(text)
+        if i == len(self.pieces):
+            return [self.eos_token_id]
+        piece = self.pieces[i]
+        if piece is not None:
+            return self._prefix_ids(piece[len(partial):])
+
+        allowed = []
+        budget = self.max_digits - len(partial.replace(".", ""))
+        if partial != "0":
+            tables = [self.digit_ids] if not partial else [self.digit_ids, self.zero_lead_ids]
+            for table in tables:
+                for length, ids in table.items():
+                    if length <= budget:
+                        allowed += ids
+        if partial and "." not in partial and budget > 0:
+            allowed += self.dot_ids
+        if partial and not partial.endswith("."):
+            allowed += self._prefix_ids(self.pieces[i + 1])
+        # Never hand back an empty set: that masks every logit and derails decoding
+        return allowed or self._prefix_ids(self.pieces[i + 1]) or [self.eos_token_id]
+
+    def is_complete(self, text: str) -> bool:
+        return self.parse(text)[0] == len(self.pieces)
+
+    def generate_kwargs(self) -> dict:
+        """Fresh logits processor + stopping criterion for one generation call."""
+        state = {"prompt_len": None}
+
+        def generated_text(input_ids) -> str:
+            if state["prompt_len"] is None:
+                state["prompt_len"] = input_ids.shape[1]
+            return "".join(self.token_text[t] for t in input_ids[0, state["prompt_len"]:].tolist())
+
+        constraint = self
+
+        class _Processor(LogitsProcessor):
+            def __call__(self, input_ids, scores):
+                mask = torch.full_like(scores, float("-inf"))
+                mask[:, constraint.allowed_ids(generated_text(input_ids))] = 0
+                return scores + mask
+
+        class _Stop(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                done = constraint.is_complete(generated_text(input_ids))
+                return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+        return {
+            "logits_processor": LogitsProcessorList([_Processor()]),
+            "stopping_criteria": StoppingCriteriaList([_Stop()]),
+        }
+
+
+def llm_estimate(event: dict, donor_names: list, baseline: tuple, generator,
+                 constraint: KpiJsonConstraint = None) -> dict:
+    """Query the language model to refine KPI estimates.
+
+    With a ``constraint`` the output is forced into the KPI JSON object and
+    generation stops at its closing brace instead of running to 128 tokens.
+    """
     sample_names = ", ".join(donor_names[:10])
     prompt = (
         f"Estimate KPIs for this charity event.\n"
@@ -50,8 +171,10 @@ def llm_estimate(event: dict, donor_names: list, baseline: tuple, generator) ->
         "retention_pct, attendees, revenue."
     )
 
+    gen_kwargs = constraint.generate_kwargs() if constraint is not None else {}
+
     try:
-        result = generator(prompt, max_new_tokens=128, do_sample=False)
+        result = generator(prompt, max_new_tokens=128, do_sample=False, **gen_kwargs)
         text = result[0]["generated_text"]
         if text.startswith(prompt):
             text = text[len(prompt) :]
@@ -83,6 +206,11 @@ if __name__ == "__main__":
         default="/Users/solomonchu/PycharmProjects/Project_Donor/gemma-3-4b-pt",
         help="HuggingFace model name or path",
     )
+    ap.add_argument(
+        "--unconstrained",
+        action="store_true",
+        help="Let the LLM generate free-form text instead of forcing the KPI JSON object",
+    )
     ap.add_argument("--out_csv", default="simulation_results.csv", help="Where to save KPI CSV")
     ap.add_argument("--report", default="event_report.txt", help="Where to save text report")
     args = ap.parse_args()
@@ -93,7 +221,8 @@ if __name__ == "__main__":
 
     baseline = baseline_estimate(event, len(donors), args.scale)
     generator = pipeline("text-generation", model=args.model)
-    kpi = llm_estimate(event, donor_names, baseline, generator)
+    constraint = None if args.unconstrained else KpiJsonConstraint(generator.tokenizer)
+    kpi = llm_estimate(event, donor_names, baseline, generator, constraint)
 
     event_results = {**event, **kpi}
     with open(args.out_csv, "w", newline="", encoding="utf-8") as f: